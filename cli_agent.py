@@ -1,24 +1,271 @@
 import subprocess
-import json
+import asyncio
+import hashlib
+import io
+import threading
+import time
 import platform
 import os
-import pickle
+import locale
+import mmap
+import re
+import shlex
+import shutil
+import signal
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
 from datetime import datetime
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 import boto3
+from botocore.config import Config
 from strands import Agent, tool
 from safety_guardrails import SafetyGuardrails
+from fast_json import dumps, loads
+
+# Bedrock model used for the agent and for direct command/answer generation
+MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+
+# Number of recent interactions kept in conversation memory
+MEMORY_LIMIT = 20
+
+# Lines the memory log may reach before it is rewritten down to MEMORY_LIMIT
+MEMORY_COMPACT_LINES = 2 * MEMORY_LIMIT
+
+# Number of generated answers kept for repeated question/output pairs
+ANSWER_CACHE_SIZE = 256
+
+# Characters that need a shell to interpret (pipes, redirection, expansion, globbing, ...)
+_SHELL_METACHARACTERS = re.compile(r'[|&;<>$`\\*?()\[\]{}~#=!\n]')
+
+# First line of a model reply that is neither a markdown fence nor a comment
+_COMMAND_LINE_RE = re.compile(r'^[ \t]*(?!```|#)(\S.*)$', re.M)
+
+# Lead-in text the model sometimes puts before the command ("To check disk usage: ", "Run: ")
+_PREFIX_RE = re.compile(
+    r'^(?:To (?:check|see|find|get|list|show|display)\b[^:]*:|(?:Running|Execute|Command|Use|Try|Run):)\s*',
+    re.I
+)
+
+# A "To <verb> ..." sentence left over after prefix stripping is prose, not a command
+_LEAD_IN_RE = re.compile(r'^To (?:check|see|find|get|list|show|display)\b', re.I)
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share a cache entry."""
+    return ' '.join(question.split()).rstrip('?!. ')
+
+
+def _extract_command(reply: str) -> str:
+    """Pull the command out of a model reply, or return '' if the reply has none."""
+    # Take the first real command line and strip any lead-in text, quotes and backticks
+    match = _COMMAND_LINE_RE.search(reply)
+    command = _PREFIX_RE.sub('', match.group(1).strip()).strip('`"\' ') if match else ''
+    # e.g. "To check disk usage, run df -h" has no colon to split the command off at
+    if _LEAD_IN_RE.match(command):
+        return ''
+    return command
+
+
+def _output_digest(text: str) -> bytes:
+    """Fixed-size fingerprint of command output, so cache keys don't hold the output itself."""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+# Default cap on captured stdout/stderr per stream, and command time limit in seconds
+DEFAULT_MAX_CAPTURE_BYTES = 64 * 1024
+DEFAULT_COMMAND_TIMEOUT = 300
+
+_READ_SIZE = 64 * 1024
+
+# Seconds to wait for output readers after a timed-out command's process group is killed
+_KILL_GRACE_SECONDS = 5
+
+# Bedrock request envelope; only max_tokens and the JSON-encoded prompt vary per call
+_BODY_TEMPLATE = b'{"anthropic_version":"bedrock-2023-05-31","max_tokens":%d,"messages":[{"role":"user","content":%b}]}'
+
+
+@lru_cache(maxsize=1)
+def _load_system_prompt() -> str:
+    """Load system prompt from SYSTEM-PROMPT.md file (read once per process)."""
+    try:
+        with open('SYSTEM-PROMPT.md', 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            # Decode straight from the mapped page cache, which uvicorn workers share,
+            # instead of reading into a private buffer first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return str(mapped, 'utf-8')
+    except FileNotFoundError:
+        return "You are a CLI Command Agent that helps execute system commands and answer questions."
+
+
+def _request_body(prompt: str, max_tokens: int) -> bytes:
+    """Build the Bedrock request body for a single-turn prompt."""
+    return _BODY_TEMPLATE % (max_tokens, dumps(prompt))
+
+
+@lru_cache(maxsize=1)
+def _get_bedrock_client():
+    """Create the Bedrock runtime client once per process and share its connection pool."""
+    return boto3.client(
+        'bedrock-runtime',
+        region_name='us-east-1',
+        config=Config(
+            max_pool_connections=64,
+            retries={'max_attempts': 2, 'mode': 'adaptive'},
+            tcp_keepalive=True
+        )
+    )
+
+
+@lru_cache(maxsize=256)
+def _resolve_executable(name: str) -> Optional[str]:
+    """Look up an executable on PATH once per name."""
+    return shutil.which(name)
+
+
+def _direct_argv(command: str) -> Optional[List[str]]:
+    """Split a command into argv when it can run without a shell, else return None."""
+    # cmd.exe builtins (dir, type, ...) have no executable of their own
+    if platform.system() == 'Windows' or _SHELL_METACHARACTERS.search(command):
+        return None
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    # Shell builtins such as cd or export are not on PATH
+    if not args or _resolve_executable(args[0]) is None:
+        return None
+    return args
+
+
+# Set by restrict_fd_inheritance(); until then commands are spawned with close_fds=True
+_fds_restricted = False
+
+
+def restrict_fd_inheritance() -> bool:
+    """Mark every descriptor above stderr non-inheritable so commands can skip close_fds.
+    
+    Python creates descriptors non-inheritable (PEP 446), but some are made
+    inheritable on purpose. A multi-worker uvicorn does this for its listening
+    socket, and spawned workers also inherit multiprocessing pipes. Without
+    this pass, a command run with close_fds=False could hold the server port
+    or accept other users' connections. Call it at startup; descriptors opened
+    later with set_inheritable(True) would still leak. Returns True when
+    close_fds=False is now safe to use.
+    """
+    global _fds_restricted
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            fds = [int(name) for name in os.listdir(fd_dir)]
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for fd in fds:
+            if fd > 2:
+                try:
+                    os.set_inheritable(fd, False)
+                except OSError:
+                    pass  # e.g. the descriptor listdir used, already closed
+        _fds_restricted = True
+        break
+    return _fds_restricted
+
+
+def _kill_process_group(process: subprocess.Popen):
+    """Kill a command started in its own session along with everything it spawned.
+    
+    Killing only /bin/sh would leave a pipeline's children holding the output
+    pipes open, so the reader threads would wait for them to exit on their own.
+    """
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+
+class _BoundedCapture:
+    """Collects a pipe's output while keeping only the last `limit` bytes."""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks = deque()
+        self.size = 0
+        self.total = 0
+    
+    def drain(self, pipe):
+        """Read the pipe to EOF, discarding the oldest output beyond the limit."""
+        with pipe:
+            for chunk in iter(lambda: pipe.read1(_READ_SIZE), b''):
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+                self.total += len(chunk)
+                # Drop whole chunks while the remainder still covers the limit
+                while self.size - len(self.chunks[0]) >= self.limit:
+                    self.size -= len(self.chunks.popleft())
+    
+    def getvalue(self, encoding: str) -> str:
+        """Return the retained output, noting when earlier output was dropped."""
+        # Match text=True: locale encoding with universal newlines (\r\n and \r become \n)
+        data = io.BytesIO(b''.join(self.chunks)[-self.limit:])
+        text = io.TextIOWrapper(data, encoding=encoding, errors='replace').read()
+        if self.total > self.limit:
+            text = f"[... {self.total - self.limit} bytes of earlier output truncated ...]\n" + text
+        return text
+
+
+def _ignore_result(future: asyncio.Future):
+    """Done-callback that retrieves and discards a future's result or exception."""
+    if not future.cancelled():
+        future.exception()
+
+
+async def _iterate_in_thread(iterable: Iterable[Any], executor: Executor = None) -> AsyncIterator[Any]:
+    """Consume a blocking iterator on a worker thread and yield its items on the event loop."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    
+    def pump():
+        try:
+            for item in iterable:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+    
+    worker = loop.run_in_executor(executor, pump)
+    while True:
+        item, error = await queue.get()
+        if item is done:
+            break
+        yield item
+    await worker
+    if error:
+        raise error
+
 
 class CLIAgent(Agent):
     """Agent that can execute CLI commands and handle complex multi-step tasks."""
     
-    def __init__(self, session_id: str = None, safe_mode: bool = True):
+    def __init__(self, session_id: str = None, safe_mode: bool = True, speculative_answers: bool = False,
+                 max_capture_bytes: int = DEFAULT_MAX_CAPTURE_BYTES, command_timeout: float = DEFAULT_COMMAND_TIMEOUT,
+                 executor: Executor = None):
         # Initialize safety guardrails
         self.safety = SafetyGuardrails(safe_mode=safe_mode)
         self.safe_mode = safe_mode
+        self.speculative_answers = speculative_answers
+        self.max_capture_bytes = max_capture_bytes
+        self.command_timeout = command_timeout
+        # Thread pool for blocking work in the async API (None uses the event loop default)
+        self.executor = executor
         
         # Load and display system prompt
-        system_prompt = self._load_system_prompt()
+        system_prompt = _load_system_prompt()
         print("🤖 CLI Agent System Prompt:")
         print("=" * 50)
         print(system_prompt)
@@ -33,53 +280,96 @@ class CLIAgent(Agent):
         super().__init__(
             name="CLI Command Agent",
             description="An agent that can execute any CLI command and handle complex tasks by breaking them into steps",
-            model="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
+            model=MODEL_ID,
             system_prompt=system_prompt
         )
-        self.bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
-        self.session_id = session_id or f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        self.memory_file = f".cli_memory_{self.session_id}.pkl"
+        self.bedrock = _get_bedrock_client()
+        # Include the pid so uvicorn workers started together don't share a memory file
+        self.session_id = session_id or f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.memory_file = f".cli_memory_{self.session_id}.jsonl"
+        self._memory_lock = threading.Lock()
+        self._memory_lines = 0
         self.conversation_history = self._load_memory()
+        
+        # Cache Bedrock round-trips for repeated questions and identical outputs
+        self._question_to_command = lru_cache(maxsize=256)(self._question_to_command)
+        self._answer_cache = OrderedDict()
+        self._answer_cache_lock = threading.Lock()
+        
+        # Interactive sessions repeat the same commands; skip re-running the rule engine
+        self._validate_cached = lru_cache(maxsize=256)(self.safety.validate_command)
+    
+    def set_safe_mode(self, safe_mode: bool):
+        """Switch safety mode, discarding validations made under the previous mode."""
+        self.safe_mode = safe_mode
+        self.safety.safe_mode = safe_mode
+        self._validate_cached = lru_cache(maxsize=256)(self.safety.validate_command)
+    
+    def _iter_memory_records(self) -> Iterator[Dict[str, Any]]:
+        """Yield records from the memory log, skipping lines that fail to parse."""
+        with open(self.memory_file, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield loads(line)
+                except ValueError as e:
+                    print(f"⚠️  Warning: Skipping corrupt memory record {self.memory_file}:{line_number}: {e}")
     
-    def _load_system_prompt(self) -> str:
-        """Load system prompt from SYSTEM-PROMPT.md file."""
+    def _load_memory(self) -> Deque[Dict[str, Any]]:
+        """Load conversation history from the append-only JSONL log."""
         try:
-            with open('SYSTEM-PROMPT.md', 'r', encoding='utf-8') as f:
-                return f.read()
+            history = deque(self._iter_memory_records(), maxlen=MEMORY_LIMIT)
         except FileNotFoundError:
-            return "You are a CLI Command Agent that helps execute system commands and answer questions."
-    
-    def _load_memory(self) -> List[Dict[str, Any]]:
-        """Load conversation history from file."""
-        if os.path.exists(self.memory_file):
-            try:
-                with open(self.memory_file, 'rb') as f:
-                    return pickle.load(f)
-            except:
-                pass
-        return []
+            return deque(maxlen=MEMORY_LIMIT)
+        except OSError as e:
+            print(f"⚠️  Warning: Could not read memory file {self.memory_file}: {e}")
+            return deque(maxlen=MEMORY_LIMIT)
+        
+        # The log may hold more than the retained window; rewrite it to match
+        self.conversation_history = history
+        if len(history) == history.maxlen:
+            self._save_memory()
+        else:
+            self._memory_lines = len(history)
+        return history
     
     def _save_memory(self):
-        """Save conversation history to file."""
+        """Rewrite the memory log with only the retained interactions."""
+        # Write a temporary file and swap it in so a crash can't lose the history
+        temp_file = f"{self.memory_file}.tmp"
         try:
-            with open(self.memory_file, 'wb') as f:
-                pickle.dump(self.conversation_history, f)
-        except:
-            pass
+            with open(temp_file, 'wb') as f:
+                for record in self.conversation_history:
+                    f.write(dumps(record) + b"\n")
+            os.replace(temp_file, self.memory_file)
+            self._memory_lines = len(self.conversation_history)
+        except OSError as e:
+            print(f"⚠️  Warning: Could not save memory file {self.memory_file}: {e}")
     
     def _add_to_memory(self, interaction_type: str, input_data: str, output_data: str, success: bool = True):
         """Add interaction to conversation memory."""
-        self.conversation_history.append({
+        record = {
             'timestamp': datetime.now().isoformat(),
             'type': interaction_type,
             'input': input_data,
             'output': output_data,
             'success': success
-        })
-        # Keep only last 20 interactions
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-20:]
-        self._save_memory()
+        }
+        # Sessions run on worker threads; keep the deque, log and line count consistent
+        with self._memory_lock:
+            # Bounded deque evicts the oldest interaction automatically
+            self.conversation_history.append(record)
+            try:
+                with open(self.memory_file, 'ab') as f:
+                    f.write(dumps(record) + b"\n")
+                self._memory_lines += 1
+            except OSError as e:
+                print(f"⚠️  Warning: Could not append to memory file {self.memory_file}: {e}")
+            
+            # Compact periodically so a long-running server's log stays bounded
+            if self._memory_lines > MEMORY_COMPACT_LINES:
+                self._save_memory()
     
     @tool
     def execute_command(self, command: str, working_directory: str = None, force: bool = False) -> Dict[str, Any]:
@@ -99,7 +389,7 @@ class CLIAgent(Agent):
         
         # Safety validation (unless forced)
         if not force:
-            validation = self.safety.validate_command(command, working_directory)
+            validation = self._validate_cached(command, working_directory)
             
             # Display risk assessment
             risk_level = validation['risk_level']
@@ -156,13 +446,7 @@ class CLIAgent(Agent):
             
         try:
             print("⚙️  Executing command...")
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                cwd=working_directory
-            )
+            result = self._run_process(command, working_directory)
             
             print(f"📤 Command output:")
             if result.stdout:
@@ -193,6 +477,217 @@ class CLIAgent(Agent):
                 "success": False
             }
     
+    def _run_process(self, command: str, working_directory: str = None) -> subprocess.CompletedProcess:
+        """Run a command, capturing at most max_capture_bytes of each output stream."""
+        # Plain commands are exec'd directly to skip spawning /bin/sh
+        args = _direct_argv(command)
+        process = subprocess.Popen(
+            args or command,
+            shell=args is None,
+            executable=_resolve_executable(args[0]) if args else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=_READ_SIZE,
+            cwd=working_directory,
+            # Skipping the close-all-fds pass makes each spawn noticeably cheaper, but is
+            # only safe once restrict_fd_inheritance() has cleared inheritable descriptors
+            # such as uvicorn's listening socket; see its docstring for the trade-off
+            close_fds=not _fds_restricted,
+            # Run in its own session so signals aimed at the server don't hit the command
+            start_new_session=True
+        )
+        
+        # Drain both pipes concurrently so a full stderr pipe can't block stdout
+        stdout, stderr = _BoundedCapture(self.max_capture_bytes), _BoundedCapture(self.max_capture_bytes)
+        readers = [
+            threading.Thread(target=capture.drain, args=(pipe,), daemon=True)
+            for capture, pipe in ((stdout, process.stdout), (stderr, process.stderr))
+        ]
+        for reader in readers:
+            reader.start()
+        
+        # One deadline covers both the process and reading its output: background
+        # children (e.g. "yes &") can keep the pipes open after the shell exits
+        deadline = None if self.command_timeout is None else time.monotonic() + self.command_timeout
+        
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.monotonic())
+        
+        try:
+            returncode = process.wait(timeout=remaining())
+            for reader in readers:
+                reader.join(remaining())
+            timed_out = any(reader.is_alive() for reader in readers)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+        
+        if timed_out:
+            _kill_process_group(process)
+            process.wait()
+            # Killing the group closes the pipes; the grace period only matters where
+            # killpg is unavailable and stray children may still hold them
+            for reader in readers:
+                reader.join(_KILL_GRACE_SECONDS)
+            raise subprocess.TimeoutExpired(command, self.command_timeout)
+        
+        encoding = locale.getpreferredencoding(False)
+        return subprocess.CompletedProcess(
+            command, returncode, stdout.getvalue(encoding), stderr.getvalue(encoding)
+        )
+    
+    def _invoke_model(self, prompt: str, max_tokens: int) -> str:
+        """Send a single-turn prompt to Bedrock and return the response text."""
+        response = self.bedrock.invoke_model(
+            modelId=MODEL_ID,
+            body=_request_body(prompt, max_tokens)
+        )
+        result = loads(response['body'].read())
+        return result['content'][0]['text'].strip()
+    
+    def _invoke_model_stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        """Send a single-turn prompt to Bedrock and yield the response text as it is generated."""
+        response = self.bedrock.invoke_model_with_response_stream(
+            modelId=MODEL_ID,
+            body=_request_body(prompt, max_tokens)
+        )
+        for event in response['body']:
+            if 'chunk' not in event:
+                continue
+            chunk = loads(event['chunk']['bytes'])
+            if chunk.get('type') == 'content_block_delta':
+                text = chunk['delta'].get('text')
+                if text:
+                    yield text
+    
+    def _question_to_command(self, question: str, system: str) -> str:
+        """Ask the model for the single command that answers a question (LRU cached)."""
+        prompt = f"Question: {question}\n\nWhat single {system} command answers this? Reply with ONLY the command:"
+        command = _extract_command(self._invoke_model(prompt, 200))
+        
+        # If still empty or invalid, retry with clearer prompt
+        if not command:
+            command = self._retry_command(question, system)
+        
+        return command
+    
+    def _retry_command(self, question: str, system: str) -> str:
+        """Ask again with a stricter prompt after the model's first reply held no usable command."""
+        retry_prompt = f"What is the exact {system} command to: {question}\n\nRespond with ONLY the command, no explanation:"
+        command = _extract_command(self._invoke_model(retry_prompt, 50))
+        if not command:
+            raise ValueError("the model did not return a usable command")
+        return command
+    
+    def _interpret_prompt(self, question: str, command: str, stdout: str, stderr: str) -> str:
+        """Build the prompt asking the model to explain a command's output."""
+        return f"Question: {question}\nCommand: {command}\nOutput: {stdout}\nError: {stderr}\n\nAnswer in plain English:"
+    
+    def _answer_key(self, question: str, command: str, stdout: str, stderr: str) -> Tuple[str, str, bytes, bytes]:
+        """Build the answer cache key from the question, command and output digests."""
+        return (question, command, _output_digest(stdout), _output_digest(stderr))
+    
+    def _get_cached_answer(self, key: Tuple[str, str, bytes, bytes]) -> str:
+        """Return a previously generated answer, or None on a cache miss."""
+        with self._answer_cache_lock:
+            answer = self._answer_cache.get(key)
+            if answer is not None:
+                self._answer_cache.move_to_end(key)
+            return answer
+    
+    def _cache_answer(self, key: Tuple[str, str, bytes, bytes], answer: str):
+        """Remember a generated answer, evicting the least recently used one."""
+        with self._answer_cache_lock:
+            self._answer_cache[key] = answer
+            self._answer_cache.move_to_end(key)
+            if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+                self._answer_cache.popitem(last=False)
+    
+    def _interpret(self, question: str, command: str, stdout: str, stderr: str) -> str:
+        """Ask the model to explain a command's output in plain English (LRU cached)."""
+        key = self._answer_key(question, command, stdout, stderr)
+        answer = self._get_cached_answer(key)
+        if answer is None:
+            answer = self._invoke_model(self._interpret_prompt(question, command, stdout, stderr), 300)
+            self._cache_answer(key, answer)
+        return answer
+    
+    def _interpret_stream(self, question: str, command: str, stdout: str, stderr: str) -> Iterator[str]:
+        """Streaming variant of _interpret; a cache hit is yielded as a single chunk."""
+        key = self._answer_key(question, command, stdout, stderr)
+        answer = self._get_cached_answer(key)
+        if answer is not None:
+            yield answer
+            return
+        
+        chunks = []
+        for text in self._invoke_model_stream(self._interpret_prompt(question, command, stdout, stderr), 300):
+            if not chunks:
+                text = text.lstrip()
+                if not text:
+                    continue
+            chunks.append(text)
+            yield text
+        self._cache_answer(key, ''.join(chunks).strip())
+    
+    @tool
+    def cache_stats(self) -> Dict[str, Any]:
+        """Report hit/miss statistics for the agent's internal caches (debugging aid).
+        
+        Returns:
+            Dictionary with statistics for the command, answer and validation caches
+        """
+        command_info = self._question_to_command.cache_info()
+        validation_info = self._validate_cached.cache_info()
+        return {
+            "command_cache": command_info._asdict(),
+            "answer_cache": {"currsize": len(self._answer_cache), "maxsize": ANSWER_CACHE_SIZE},
+            "validation_cache": validation_info._asdict()
+        }
+    
+    def _start_question(self, tool_name: str, question: str, working_directory: str = None) -> str:
+        """Log the start of a question and return its normalized form for the caches."""
+        print(f"🔧 Tool: {tool_name}(question='{question}', working_directory={working_directory})")
+        print(f"🤔 Thinking: Converting question '{question}' to appropriate command for {platform.system()}...")
+        return normalize_question(question)
+    
+    def _report_execution(self, exec_result: Dict[str, Any]):
+        """Log how the selected command went before its output is interpreted."""
+        if exec_result['success']:
+            print(f"✅ Command executed successfully")
+        else:
+            print(f"❌ Command failed with return code {exec_result['return_code']}")
+            if exec_result['stderr']:
+                print(f"Error: {exec_result['stderr']}")
+        
+        print(f"🧠 Interpreting results...")
+    
+    def _question_result(self, question: str, command: str, answer: str, exec_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Record a successfully answered question and build its result dictionary."""
+        print(f"📝 Generated answer: {answer[:100]}{'...' if len(answer) > 100 else ''}")
+        
+        # Save to memory
+        self._add_to_memory('question', question, answer, exec_result['success'])
+        
+        return {
+            "question": question,
+            "command_used": command,
+            "answer": answer,
+            "raw_output": exec_result,
+            "success": exec_result['success']
+        }
+    
+    def _question_error(self, question: str, error: Exception) -> Dict[str, Any]:
+        """Record a question that could not be processed and build its result dictionary."""
+        error_msg = f"Sorry, I couldn't process your question: {str(error)}"
+        self._add_to_memory('question', question, error_msg, False)
+        return {
+            "question": question,
+            "command_used": "unknown",
+            "answer": error_msg,
+            "raw_output": None,
+            "success": False
+        }
+    
     @tool
     def answer_question(self, question: str, working_directory: str = None) -> Dict[str, Any]:
         """Answer a natural language question by determining the appropriate CLI command and executing it.
@@ -204,119 +699,74 @@ class CLIAgent(Agent):
         Returns:
             Dictionary with the answer, command used, and execution result
         """
-        print(f"🔧 Tool: answer_question(question='{question}', working_directory={working_directory})")
-        
-        prompt = f"Question: {question}\n\nWhat single {platform.system()} command answers this? Reply with ONLY the command:"
+        normalized = self._start_question('answer_question', question, working_directory)
         
         try:
-            print(f"🤔 Thinking: Converting question '{question}' to appropriate command for {platform.system()}...")
-            
-            response = self.bedrock.invoke_model(
-                modelId="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 200,
-                    "messages": [{"role": "user", "content": prompt}]
-                })
-            )
-            
-            result = json.loads(response['body'].read())
-            command = result['content'][0]['text'].strip()
-            
-            # Clean up the command (remove any extra text)
-            command_lines = command.split('\n')
-            
-            # Find the actual command line (skip markdown and empty lines)
-            actual_command = ""
-            for line in command_lines:
-                line = line.strip()
-                if line and not line.startswith('```') and not line.startswith('#'):
-                    actual_command = line
-                    break
-            
-            command = actual_command.strip()
-            
-            # Remove common prefixes that might be added by the LLM
-            prefixes_to_remove = [
-                "To check", "To see", "To find", "To get", "To list", "To show", "To display",
-                "Running:", "Execute:", "Command:", "Use:", "Try:", "Run:"
-            ]
-            
-            for prefix in prefixes_to_remove:
-                if command.startswith(prefix):
-                    # Find the actual command after the prefix
-                    parts = command.split()
-                    if len(parts) > 2:  # Skip the prefix words
-                        command = ' '.join(parts[2:])  # Take everything after "To check" etc.
-                    break
-            
-            # Additional cleanup - remove quotes and backticks
-            command = command.strip('`"\'')
-            
-            # If still empty or invalid, retry with clearer prompt
-            if not command or command.startswith('```') or len(command.split()) < 1:
-                retry_prompt = f"What is the exact {platform.system()} command to: {question}\n\nRespond with ONLY the command, no explanation:"
-                retry_response = self.bedrock.invoke_model(
-                    modelId="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-                    body=json.dumps({
-                        "anthropic_version": "bedrock-2023-05-31",
-                        "max_tokens": 50,
-                        "messages": [{"role": "user", "content": retry_prompt}]
-                    })
-                )
-                retry_result = json.loads(retry_response['body'].read())
-                command = retry_result['content'][0]['text'].strip().strip('`"\'')
-            
+            command = self._question_to_command(normalized, platform.system())
             print(f"💡 Selected command: {command}")
-            print(f"⚡ Executing command...")
             
-            # Execute the command
+            print(f"⚡ Executing command...")
             exec_result = self.execute_command(command, working_directory)
-            
-            if exec_result['success']:
-                print(f"✅ Command executed successfully")
-            else:
-                print(f"❌ Command failed with return code {exec_result['return_code']}")
-                if exec_result['stderr']:
-                    print(f"Error: {exec_result['stderr']}")
-            
-            print(f"🧠 Interpreting results...")
+            self._report_execution(exec_result)
             
             # Generate human-readable answer
-            answer_prompt = f"Question: {question}\nCommand: {command}\nOutput: {exec_result['stdout']}\nError: {exec_result['stderr']}\n\nAnswer in plain English:"
+            answer = self._interpret(normalized, command, exec_result['stdout'], exec_result['stderr'])
+            return self._question_result(question, command, answer, exec_result)
             
-            answer_response = self.bedrock.invoke_model(
-                modelId="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 300,
-                    "messages": [{"role": "user", "content": answer_prompt}]
-                })
-            )
+        except Exception as e:
+            return self._question_error(question, e)
+    
+    def _run_blocking(self, func, *args) -> asyncio.Future:
+        """Run a blocking call on the agent's executor and return an awaitable future."""
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    async def answer_question_stream(self, question: str, working_directory: str = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Streaming variant of answer_question for the web UI.
+        
+        Yields ("command", command) once the command is chosen, ("output", exec_result)
+        after it runs, one ("answer", text) event per generated chunk of the answer,
+        and finally ("result", result) with the same dictionary answer_question returns.
+        """
+        normalized = self._start_question('answer_question_stream', question, working_directory)
+        
+        try:
+            command = await self._run_blocking(self._question_to_command, normalized, platform.system())
+            print(f"💡 Selected command: {command}")
+            yield "command", command
             
-            answer_result = json.loads(answer_response['body'].read())
-            answer = answer_result['content'][0]['text'].strip()
+            # Read-only commands often print nothing, so the answer for empty output
+            # can be generated while the command runs. When the command does print,
+            # that Bedrock call is wasted: it still runs to completion and is billed.
+            speculative = None
+            if self.speculative_answers and self.safety.assess_command_risk(command)[0] == 'safe':
+                speculative = self._run_blocking(self._interpret, normalized, command, "", "")
             
-            print(f"📝 Generated answer: {answer[:100]}{'...' if len(answer) > 100 else ''}")
+            print(f"⚡ Executing command...")
+            exec_result = await self._run_blocking(self.execute_command, command, working_directory)
             
-            # Save to memory
-            self._add_to_memory('question', question, answer, exec_result['success'])
+            if speculative:
+                if exec_result['stdout'] or exec_result['stderr']:
+                    # Not needed; just make sure a failure isn't reported as unretrieved
+                    speculative.add_done_callback(_ignore_result)
+                else:
+                    try:
+                        # On success the answer is now cached for _interpret_stream below
+                        await speculative
+                    except Exception as e:
+                        print(f"⚠️  Warning: Speculative answer failed, interpreting normally: {e}")
             
-            return {
-                "question": question,
-                "command_used": command,
-                "answer": answer,
-                "raw_output": exec_result,
-                "success": exec_result['success']
-            }
+            self._report_execution(exec_result)
+            yield "output", exec_result
+            
+            # Forward the answer as it is generated
+            chunks = []
+            answer_stream = self._interpret_stream(normalized, command, exec_result['stdout'], exec_result['stderr'])
+            async for text in _iterate_in_thread(answer_stream, self.executor):
+                chunks.append(text)
+                yield "answer", text
+            result = self._question_result(question, command, ''.join(chunks).strip(), exec_result)
             
         except Exception as e:
-            error_msg = f"Sorry, I couldn't process your question: {str(e)}"
-            self._add_to_memory('question', question, error_msg, False)
-            return {
-                "question": question,
-                "command_used": "unknown",
-                "answer": error_msg,
-                "raw_output": None,
-                "success": False
-            }
\ No newline at end of file
+            result = self._question_error(question, e)
+        
+        yield "result", result
@@ -0,0 +1,21 @@
+"""
+Fast JSON helpers for the OS Terminal Agent
+Uses orjson when it is installed and falls back to the standard library otherwise.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:
+    def dumps(obj) -> bytes:
+        """Serialize obj to compact UTF-8 JSON bytes, like orjson.dumps."""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    
+    loads = json.loads
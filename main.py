@@ -1,11 +1,92 @@
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, WebSocket
 from fastapi.responses import FileResponse
-import json
 import asyncio
-from cli_agent import CLIAgent
+import os
+import platform
+from typing import Dict, Tuple
+import uvicorn
+from cli_agent import CLIAgent, normalize_question, restrict_fd_inheritance
+from fast_json import dumps, loads
 
-app = FastAPI()
-cli_agent = CLIAgent(safe_mode=True)
+# Dedicated, bounded pool for agent work so busy sessions can't exhaust the default executor
+EXEC_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="agent")
+
+# Requests allowed to run or wait for the pool before new ones are turned away
+MAX_PENDING_REQUESTS = 32
+
+# Set AGENT_SPECULATIVE_ANSWERS=1 to interpret empty output of read-only commands
+# while they run; it trades an extra Bedrock call per command for lower latency
+SPECULATIVE_ANSWERS = os.environ.get("AGENT_SPECULATIVE_ANSWERS") == "1"
+
+cli_agent = None
+active_requests = 0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep uvicorn's listening socket and worker pipes out of executed commands
+    restrict_fd_inheritance()
+    # Build the agent at startup so the first request doesn't pay for it
+    global cli_agent
+    cli_agent = CLIAgent(safe_mode=True, executor=EXEC_POOL, speculative_answers=SPECULATIVE_ANSWERS)
+    yield
+    EXEC_POOL.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
+
+# Questions currently being answered, so identical concurrent questions share one run
+INFLIGHT: Dict[Tuple[str, str], asyncio.Future] = {}
+
+class FrameBatcher:
+    """Coalesces outgoing WebSocket frames into "bundle" messages.
+    
+    Frames are buffered and flushed together after FLUSH_DELAY seconds or once
+    FLUSH_BYTES of content is pending; consecutive chunks are merged.
+    """
+    
+    FLUSH_DELAY = 0.05
+    FLUSH_BYTES = 512
+    
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.frames = []
+        self.size = 0
+        self.timer = None
+        self.lock = asyncio.Lock()
+    
+    async def send(self, frame_type: str, content: str = None):
+        """Queue a frame, flushing when enough content is pending."""
+        if frame_type == "chunk" and self.frames and self.frames[-1]["type"] == "chunk":
+            self.frames[-1]["content"] += content
+        else:
+            frame = {"type": frame_type}
+            if content is not None:
+                frame["content"] = content
+            self.frames.append(frame)
+        self.size += len(content or "")
+        
+        if self.size >= self.FLUSH_BYTES:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.FLUSH_DELAY)
+        self.timer = None
+        await self.flush()
+    
+    async def flush(self):
+        """Send all pending frames as a single message."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        async with self.lock:
+            if not self.frames:
+                return
+            frames, self.frames, self.size = self.frames, [], 0
+            message = frames[0] if len(frames) == 1 else {"type": "bundle", "frames": frames}
+            await self.websocket.send_bytes(dumps(message))
 
 @app.get("/")
 async def serve_index():
@@ -14,62 +95,115 @@ async def serve_index():
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    frames = FrameBatcher(websocket)
     
     try:
         while True:
             data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = loads(data)
             user_message = message_data.get("message", "")
             
-            await call_agent(user_message, websocket)
-            await websocket.send_text(json.dumps({"type": "complete"}))
+            await call_agent(user_message, frames)
+            await frames.send("complete")
+            await frames.flush()
             
     except Exception as e:
         print(f"WebSocket error: {e}")
-        await websocket.send_text(json.dumps({"type": "chunk", "content": f"Error: {str(e)}"}))
-        await websocket.send_text(json.dumps({"type": "complete"}))
+        await frames.send("chunk", f"Error: {str(e)}")
+        await frames.send("complete")
+        await frames.flush()
     finally:
         await websocket.close()
 
-async def call_agent(user_message: str, websocket):
+def _format_command_output(raw_output) -> str:
+    """Combine stdout and stderr of an execution result for display."""
+    output_content = ""
+    if raw_output.get('stdout'):
+        output_content += raw_output['stdout']
+    if raw_output.get('stderr'):
+        if output_content:
+            output_content += "\n"
+        output_content += raw_output['stderr']
+    return output_content
+
+async def _send_result(result, frames: FrameBatcher):
+    """Send a finished result that was produced for another session's identical question."""
+    if result.get('raw_output'):
+        await frames.send("chunk", f"\n💡 Command: {result['command_used']}")
+        output_content = _format_command_output(result['raw_output'])
+        if output_content:
+            await frames.send("command_output", output_content)
+    prefix = "\n📝 Answer: " if result['success'] else "\n❌ "
+    await frames.send("chunk", prefix + result['answer'])
+
+async def call_agent(user_message: str, frames: FrameBatcher):
+    global active_requests
+    if active_requests >= MAX_PENDING_REQUESTS:
+        await frames.send("busy", "⏳ The agent is busy right now, please try again shortly.")
+        await frames.flush()
+        return
+    
+    active_requests += 1
+    key = (normalize_question(user_message), platform.system())
+    future = None
+    result = None
     try:
-        await websocket.send_text(json.dumps({"type": "chunk", "content": "🤔 Processing your request..."}))
+        await frames.send("chunk", "🤔 Processing your request...")
         
-        # Use the strands-based CLI agent
-        result = await asyncio.to_thread(cli_agent.answer_question, user_message)
+        # Reuse the answer if another session is already asking the same question
+        pending = INFLIGHT.get(key)
+        if pending is not None:
+            shared_result = await asyncio.shield(pending)
+            if shared_result is not None:
+                await _send_result(shared_result, frames)
+                return
         
-        if result['success']:
-            await websocket.send_text(json.dumps({"type": "chunk", "content": f"\n💡 Command: {result['command_used']}"}))
-            
-            # Send command output if available
-            if result.get('raw_output') and (result['raw_output'].get('stdout') or result['raw_output'].get('stderr')):
-                output_content = ""
-                if result['raw_output'].get('stdout'):
-                    output_content += result['raw_output']['stdout']
-                if result['raw_output'].get('stderr'):
-                    if output_content:
-                        output_content += "\n"
-                    output_content += result['raw_output']['stderr']
-                
-                await websocket.send_text(json.dumps({
-                    "type": "command_output", 
-                    "content": output_content
-                }))
-            
-            await websocket.send_text(json.dumps({"type": "chunk", "content": f"\n📝 Answer: {result['answer']}"}))
-        else:
-            await websocket.send_text(json.dumps({"type": "chunk", "content": f"\n❌ {result['answer']}"}))
-            
-            # Send error output if available
-            if result.get('raw_output') and result['raw_output'].get('stderr'):
-                await websocket.send_text(json.dumps({
-                    "type": "command_output", 
-                    "content": result['raw_output']['stderr']
-                }))
+        future = asyncio.get_running_loop().create_future()
+        INFLIGHT[key] = future
+        
+        # Stream the strands-based CLI agent's progress as it happens
+        answer_started = False
+        succeeded = True
+        async for kind, payload in cli_agent.answer_question_stream(user_message):
+            if kind == "command":
+                await frames.send("chunk", f"\n💡 Command: {payload}")
+            elif kind == "output":
+                succeeded = payload['success']
+                output_content = _format_command_output(payload)
+                if output_content:
+                    await frames.send("command_output", output_content)
+            elif kind == "answer":
+                if not answer_started:
+                    answer_started = True
+                    await frames.send("chunk", "\n📝 Answer: " if succeeded else "\n❌ ")
+                await frames.send("chunk", payload)
+            elif kind == "result":
+                result = payload
+        
+        # Failures before the answer was generated have nothing streamed yet
+        if result and not result['success'] and not answer_started:
+            await frames.send("chunk", f"\n❌ {result['answer']}")
             
     except Exception as e:
-        await websocket.send_text(json.dumps({"type": "chunk", "content": f"Error: {str(e)}"}))
+        await frames.send("chunk", f"Error: {str(e)}")
+    finally:
+        active_requests -= 1
+        if future is not None:
+            if INFLIGHT.get(key) is future:
+                del INFLIGHT[key]
+            # None tells waiters this run failed and they should ask themselves
+            future.set_result(result)
+        await frames.flush()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop has no Windows support; httptools does
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if platform.system() == "Windows" else "uvloop",
+        http="httptools",
+        ws="websockets",
+        lifespan="on",
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    )